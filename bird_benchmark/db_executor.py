@@ -39,7 +39,7 @@ class DBExecutor:
         """
         # Проверяем, что это SELECT запрос
         sql_clean = sql.strip().rstrip(";")
-        if not sql_clean.lower().startswith("select"):
+        if sql_clean[:6].lower() != "select":
             raise ValueError("Only SELECT queries are allowed")
         
         if self.db_type == "sqlite":
@@ -4,8 +4,10 @@
 
 import sqlite3
 import re
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Tuple, Any, Optional, Set
+from typing import List, Tuple, Any, Optional, Set, Iterator
 import pandas as pd
 
 
@@ -20,6 +22,46 @@ class SQLExecutor:
         self.db_path = Path(db_path)
         if not self.db_path.exists():
             raise FileNotFoundError(f"Database not found: {db_path}")
+        
+        # Соединение открывается при первом запросе и переиспользуется:
+        # кэш страниц и подготовленные выражения сохраняются между запросами
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+    
+    def close(self) -> None:
+        """Закрывает соединение с БД (следующий запрос откроет новое)."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    @contextmanager
+    def _cursor(self, sql: str) -> Iterator[sqlite3.Cursor]:
+        """
+        Выполняет SELECT и выдает курсор с результатом.
+        
+        Пока курсор открыт, соединение занято: один executor может
+        использоваться из нескольких потоков оценки.
+        """
+        # Проверяем, что это SELECT запрос
+        sql_clean = sql.strip().rstrip(";")
+        if sql_clean[:6].lower() != "select":
+            raise ValueError("Only SELECT queries are allowed")
+        
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(
+                    self.db_path.as_posix(),
+                    check_same_thread=False,
+                )
+                # Устанавливаем режим, который позволяет сравнивать результаты
+                self._conn.row_factory = sqlite3.Row
+            cur = self._conn.cursor()
+            try:
+                cur.execute(sql_clean)
+                yield cur
+            finally:
+                cur.close()
     
     def execute(self, sql: str) -> Tuple[List[str], List[Tuple[Any, ...]]]:
         """
@@ -32,27 +74,14 @@ class SQLExecutor:
             Tuple[headers, rows] где headers - список названий колонок,
             rows - список кортежей со значениями
         """
-        # Проверяем, что это SELECT запрос
-        sql_clean = sql.strip().rstrip(";")
-        if not sql_clean.lower().startswith("select"):
-            raise ValueError("Only SELECT queries are allowed")
-        
-        conn = sqlite3.connect(self.db_path.as_posix())
-        try:
-            # Устанавливаем режим, который позволяет сравнивать результаты
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            
-            cur.execute(sql_clean)
+        with self._cursor(sql) as cur:
             rows = cur.fetchall()
             
             # Преобразуем Row объекты в кортежи для сравнения
-            headers = [desc[0] for desc in cur.description] if cur.description else []
+            headers = _headers(cur)
             rows_tuples = [tuple(row) for row in rows]
             
             return headers, rows_tuples
-        finally:
-            conn.close()
     
     def execute_to_set(self, sql: str) -> Set[Tuple[Any, ...]]:
         """
@@ -73,6 +102,7 @@ class SQLExecutor:
         sql1: str,
         sql2: str,
         order_matters: bool = False,
+        scalar_expected: bool = False,
     ) -> bool:
         """
         Сравнивает результаты двух SQL запросов.
@@ -81,10 +111,15 @@ class SQLExecutor:
             sql1: Первый SQL запрос
             sql2: Второй SQL запрос
             order_matters: Если True, порядок строк имеет значение
+            scalar_expected: Если True, ожидается одна строка (агрегат):
+                сначала читаются только первые строки результатов
             
         Returns:
             True если результаты совпадают, False иначе
         """
+        if scalar_expected:
+            return self._compare_scalar(sql1, sql2, order_matters)
+        
         try:
             headers1, rows1 = self.execute(sql1)
         except Exception:
@@ -107,6 +142,55 @@ class SQLExecutor:
         else:
             return set(rows1) == set(rows2)
 
+    def _compare_scalar(self, sql1: str, sql2: str, order_matters: bool) -> bool:
+        """
+        compare_results для ожидаемого скаляра (агрегата): результаты
+        читаются по строкам, и несовпадение видно без чтения всех строк.
+        
+        Каждый запрос выполняется один раз; если результат всё-таки
+        не скаляр, строки дочитываются тем же курсором.
+        """
+        try:
+            with self._cursor(sql1) as cur:
+                headers1 = _headers(cur)
+                rows1 = [tuple(row) for row in cur.fetchmany(2)]
+                if len(rows1) > 1:
+                    rows1 += [tuple(row) for row in cur.fetchall()]
+        except Exception:
+            # Если первый запрос не выполнился, считаем что не совпадает
+            return False
+        
+        try:
+            with self._cursor(sql2) as cur:
+                headers2 = _headers(cur)
+                if set(headers1) != set(headers2):
+                    return False
+                if len(rows1) > 1:
+                    rows2 = [tuple(row) for row in cur.fetchall()]
+                    if order_matters:
+                        return rows1 == rows2
+                    return set(rows1) == set(rows2)
+                
+                # Первый результат — не больше одной строки: любая другая
+                # строка второго результата означает несовпадение
+                matched = 0
+                for row in cur:
+                    if not rows1 or tuple(row) != rows1[0]:
+                        return False
+                    matched += 1
+                    if order_matters and matched > 1:
+                        return False
+        except Exception:
+            # Если второй запрос не выполнился, считаем что не совпадает
+            return False
+        
+        # Повторы одной строки без учёта порядка совпадают с ней как множество
+        return matched == len(rows1) if order_matters else bool(matched) == bool(rows1)
+
+def _headers(cur: sqlite3.Cursor) -> List[str]:
+    """Названия колонок результата курсора."""
+    return [desc[0] for desc in cur.description] if cur.description else []
+
 
 def normalize_sql(sql: str) -> str:
     """
@@ -1,40 +1,71 @@
 import os
-import sqlite3
+import threading
+import urllib.request
 from pathlib import Path
 
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
 
-from text2sql.db import list_tables_and_schema
+from text2sql.db import get_pooled_connection, list_tables_and_schema
 from text2sql.llm import (
     generate_sql_from_nl,
-    decide_visualization,
-    explain_sql_brief,
-    summarize_result_brief,
+    analyze_result,
 )
 
 # -------------------------------------------------
 # Utils
 # -------------------------------------------------
 
+MAX_TABLE_ROWS = 1000
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+if "://" not in OLLAMA_HOST:
+    OLLAMA_HOST = f"http://{OLLAMA_HOST}"
+
+
 def check_ollama_status() -> bool:
+    # Лёгкий HTTP-пинг вместо chat-запроса: не запускает генерацию модели
     try:
-        import ollama
-        ollama.chat(
-            model=os.getenv("LLM_MODEL", "qwen3-coder:30b"),
-            messages=[{"role": "user", "content": "ping"}],
-            options={"temperature": 0},
-        )
-        return True
+        with urllib.request.urlopen(f"{OLLAMA_HOST}/api/tags", timeout=0.3):
+            return True
     except Exception:
         return False
 
 
-def run_sql(db_path: Path, sql: str) -> pd.DataFrame:
-    with sqlite3.connect(db_path) as conn:
+@st.cache_data(show_spinner=False, max_entries=64, ttl=300)
+def run_sql(db_path: str, sql: str, mtime: float) -> pd.DataFrame:
+    # Путь передаётся строкой: так ключ кэша хэшируется быстрее, чем Path.
+    # mtime входит в ключ кэша: после изменения файла запрос выполняется заново
+    with get_pooled_connection(Path(db_path)) as conn:
+        # Обычный numpy-бэкенд: dtype_backend="pyarrow" падает на не-UTF-8 BLOB
+        # и превращает колонки SQLite со смешанными типами в строки
         return pd.read_sql_query(sql, conn)
 
 
+@st.cache_data(show_spinner=False)
+def cached_schema(db_path: str, mtime: float) -> str:
+    # mtime входит в ключ кэша: после изменения файла схема перечитывается
+    return list_tables_and_schema(db_path=Path(db_path))
+
+
+def _draw_warmup_figure() -> None:
+    fig = Figure()
+    fig.add_subplot(111).plot([0, 1], [0, 1])
+    FigureCanvasAgg(fig).draw()
+
+
+@st.cache_resource(show_spinner=False)
+def warm_up_matplotlib() -> None:
+    # Первая отрисовка загружает шрифты и кэши рендерера (~сотни мс);
+    # делаем её один раз на процесс в фоне, пока пользователь вводит вопрос
+    threading.Thread(target=_draw_warmup_figure, daemon=True).start()
+
+
 # -------------------------------------------------
 # Streamlit config
 # -------------------------------------------------
@@ -46,6 +77,8 @@ st.set_page_config(
 
 st.title("📊 Text → SQL аналитика (Ollama)")
 
+warm_up_matplotlib()
+
 # -------------------------------------------------
 # Sidebar
 # -------------------------------------------------
@@ -55,9 +88,8 @@ st.sidebar.header("Настройки")
 # --- LLM status ---
 st.sidebar.subheader("LLM")
 
-# @st.cache_data(ttl=30)
-@st.cache_data(show_spinner=False)
-def cached_ollama_check():
+@st.cache_resource(ttl=30, show_spinner=False)
+def cached_ollama_check() -> bool:
     return check_ollama_status()
 
 if cached_ollama_check():
@@ -106,6 +138,11 @@ with st.form("query_form"):
         height=120,
         placeholder="Например: Все работники из города Lethbridge",
     )
+    # Чекбокс внутри формы: виджет вне формы перезапустил бы скрипт и сбросил результат
+    show_all_rows = st.checkbox(
+        f"Показывать все строки результата (по умолчанию первые {MAX_TABLE_ROWS})",
+        value=False,
+    )
     submitted = st.form_submit_button("🚀 Сгенерировать SQL")
 
 if not submitted:
@@ -139,7 +176,7 @@ st.code(sql, language="sql")
 
 with st.spinner("Выполняю запрос…"):
     try:
-        df = run_sql(db_path, sql)
+        df = run_sql(db_path.as_posix(), sql, db_path.stat().st_mtime)
     except Exception as e:
         st.error(f"Ошибка выполнения SQL: {e}")
         st.stop()
@@ -149,16 +186,37 @@ if df.empty:
     st.stop()
 
 st.subheader("Результат")
-st.dataframe(df, use_container_width=True)
+if show_all_rows or len(df) <= MAX_TABLE_ROWS:
+    st.dataframe(df, use_container_width=True)
+else:
+    st.dataframe(df.head(MAX_TABLE_ROWS), use_container_width=True)
+    st.caption(f"Показаны первые {MAX_TABLE_ROWS} из {len(df)} строк")
+
+# Превью для LLM: to_pylist строит записи в Arrow, без pandas-итератора.
+# Arrow не допускает одинаковых имён колонок (SELECT * по JOIN) — тогда через pandas
+try:
+    preview_records = pa.Table.from_pandas(df.head(20), preserve_index=False).to_pylist()
+except (ValueError, pa.ArrowException):
+    preview_records = df.head(20).to_dict(orient="records")
+
+# -------------------------------------------------
+# Analysis (explanation + summary + chart in one LLM call)
+# -------------------------------------------------
+
+with st.spinner("Готовлю объяснение и вывод…"):
+    analysis = analyze_result(
+        question=question,
+        sql=sql,
+        preview_rows=preview_records,
+        available_columns=list(df.columns),
+        schema_description=cached_schema(db_path.as_posix(), db_path.stat().st_mtime),
+    )
 
 # -------------------------------------------------
 # Visualization
 # -------------------------------------------------
 
-viz = decide_visualization(
-    question=question,
-    available_columns=list(df.columns),
-)
+viz = analysis["chart"]
 
 if viz.get("need_chart"):
     st.subheader("Визуализация")
@@ -173,31 +231,22 @@ if viz.get("need_chart"):
         elif chart_type == "line":
             st.line_chart(df.set_index(x)[y])
         elif chart_type == "pie":
-            st.pyplot(
-                df.groupby(x)[y].sum().plot.pie(autopct="%1.1f%%").figure
-            )
+            fig = Figure()
+            ax = fig.add_subplot(111)
+            df.groupby(x)[y].sum().plot.pie(ax=ax, autopct="%1.1f%%")
+            st.pyplot(fig)
 
 # -------------------------------------------------
 # Explanations
 # -------------------------------------------------
 
-with st.spinner("Готовлю объяснение…"):
-    explanation = explain_sql_brief(
-        question=question,
-        sql=sql,
-    )
+explanation = analysis["explanation"]
 
 if explanation:
     st.subheader("Что делает этот запрос")
     st.write(explanation)
 
-with st.spinner("Готовлю вывод…"):
-    summary = summarize_result_brief(
-        question=question,
-        sql=sql,
-        preview_rows=df.head(20).to_dict(orient="records"),
-        schema_description=list_tables_and_schema(db_path=db_path),
-    )
+summary = analysis["summary"]
 
 if summary:
     st.subheader("Краткий вывод")
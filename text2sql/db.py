@@ -1,7 +1,13 @@
+import codecs
+import itertools
 import os
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Any, Optional, Dict
+from typing import List, Tuple, Any, Optional, Dict, Union, BinaryIO, Iterator
 import pandas as pd
 import re
 
@@ -9,21 +15,211 @@ import re
 DATA_DIR = Path("data")
 DB_PATH = DATA_DIR / "database.db"
 
+# Общие настройки соединений: mmap и увеличенный кэш страниц
+# снижают число системных вызовов при повторных сканированиях таблиц
+_COMMON_PRAGMAS = (
+    "PRAGMA mmap_size=268435456;"
+    "PRAGMA cache_size=-65536;"
+    "PRAGMA temp_store=MEMORY;"
+)
+# WAL не блокирует читателей во время записи; NORMAL достаточно для WAL
+_WRITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;"
+    "PRAGMA synchronous=NORMAL;"
+)
+# Шаблоны для sanitize_table_name (вызывается для каждой колонки CSV)
+_NON_IDENT_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+_MULTI_UNDERSCORES = re.compile(r'_+')
+# Строковые литералы и идентификаторы в кавычках (кавычка экранируется удвоением)
+_SQL_QUOTED = re.compile(r"'(?:''|[^'])*'|\"(?:\"\"|[^\"])*\"")
+# Запрос начинается с SELECT (проверка без strip/lower-копий всей строки)
+_SELECT_PREFIX = re.compile(r"\s*select", re.IGNORECASE)
+# numpy dtype.kind -> тип колонки SQLite (bool хранится как INTEGER, даты как TEXT)
+_DTYPE_KIND_TO_SQL = {
+    'i': 'INTEGER',
+    'u': 'INTEGER',
+    'b': 'INTEGER',
+    'f': 'REAL',
+    'M': 'TEXT',
+    'O': 'TEXT',
+}
+# Кодировки, которые пробуются после указанной пользователем
+_CSV_FALLBACK_ENCODINGS = ['cp1251', 'latin-1', 'iso-8859-1']
+# Сколько байт начала CSV читается для выбора кодировки
+_ENCODING_SNIFF_BYTES = 64 * 1024
+# Размер блока строк при потоковом чтении CSV
+_CSV_CHUNK_ROWS = 50_000
 
+# Размер LRU-кэша подготовленных выражений на соединение (по умолчанию в sqlite3 — 128):
+# вместе с пулом повторный одинаковый SQL не разбирается и не планируется заново
+_STATEMENT_CACHE_SIZE = 256
+
+# Пул read-only соединений: держим открытые соединения на каждый файл БД,
+# чтобы не терять кэш страниц SQLite между запросами
+_POOL_SIZE = 5
+# Общий лимит простаивающих соединений: бенчмарки открывают тысячи файлов БД,
+# и без лимита пул исчерпал бы файловые дескрипторы процесса
+_MAX_POOLED_CONNECTIONS = 64
+# Свободные соединения по пути к БД, в порядке использования (LRU)
+_pools: "OrderedDict[str, List[sqlite3.Connection]]" = OrderedDict()
+_pooled_count = 0
+# Поколения пула (общее и по пути): close_pool/close_all_pools увеличивают их,
+# и выданные ранее соединения при возврате закрываются, а не попадают в пул
+_pool_epoch = 0
+_pool_generations: Dict[str, int] = {}
+_pools_lock = threading.Lock()
+
+# Колонки всех таблиц за один проход (табличная функция pragma_table_info, SQLite 3.16+)
+_SCHEMA_SQL = (
+    "SELECT m.name, p.name, p.type "
+    "FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+    "WHERE m.type = 'table'"
+)
+
+# Кэш текстовой схемы: (db_path, schema_version, table_name) -> схема
+_schema_cache: Dict[Tuple[str, int, Optional[str]], str] = {}
+# Кэш читают и пополняют потоки оценки бенчмарков, а сбрасывает
+# invalidate_schema_cache: все обращения к словарю — под блокировкой
+_schema_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
 def ensure_database_exists() -> None:
-    """Создает директорию для данных, но не создает стандартную БД."""
+    """
+    Создает директорию для данных, но не создает стандартную БД.
+    Выполняется один раз на процесс: get_connection вызывает её на каждом соединении.
+    """
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def get_connection(readonly: bool = True, db_path: Optional[Path] = None) -> sqlite3.Connection:
+def _apply_pragmas(conn: sqlite3.Connection, readonly: bool) -> None:
+    """
+    Применяет PRAGMA-настройки к новому соединению.
+
+    journal_mode хранится в самом файле БД, поэтому для read-only
+    соединений он не трогается.
+    """
+    if readonly:
+        conn.executescript(_COMMON_PRAGMAS + "PRAGMA query_only=1;")
+    else:
+        conn.executescript(_WRITE_PRAGMAS + _COMMON_PRAGMAS)
+
+
+def get_connection(
+    readonly: bool = True,
+    db_path: Optional[Path] = None,
+    check_same_thread: bool = True,
+) -> sqlite3.Connection:
     if db_path is None:
         raise ValueError("db_path must be provided. No default database is used.")
     ensure_database_exists()
     if readonly:
         # Enforce read-only mode to prevent writes from generated SQL
         uri = f"file:{db_path.as_posix()}?mode=ro"
-        return sqlite3.connect(uri, uri=True, timeout=5)
-    return sqlite3.connect(db_path.as_posix(), timeout=5)
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            timeout=5,
+            check_same_thread=check_same_thread,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+        )
+    else:
+        conn = sqlite3.connect(
+            db_path.as_posix(),
+            timeout=5,
+            check_same_thread=check_same_thread,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+        )
+    _apply_pragmas(conn, readonly=readonly)
+    return conn
+
+
+@contextmanager
+def get_pooled_connection(db_path: Optional[Path] = None) -> Iterator[sqlite3.Connection]:
+    """
+    Выдает read-only соединение из пула для указанной БД.
+
+    Соединения создаются по требованию и после использования возвращаются
+    в пул (до _POOL_SIZE на файл и до _MAX_POOLED_CONNECTIONS всего),
+    лишние закрываются. При превышении общего лимита закрываются
+    соединения давно не использованных БД.
+    """
+    global _pooled_count
+    if db_path is None:
+        raise ValueError("db_path must be provided. No default database is used.")
+    db_path = Path(db_path)
+    key = db_path.as_posix()
+    with _pools_lock:
+        generation = (_pool_epoch, _pool_generations.get(key, 0))
+        idle = _pools.get(key)
+        conn = idle.pop() if idle else None
+        if conn is not None:
+            _pooled_count -= 1
+    if conn is None:
+        conn = get_connection(readonly=True, db_path=db_path, check_same_thread=False)
+    try:
+        yield conn
+    finally:
+        to_close = []
+        with _pools_lock:
+            idle = _pools.setdefault(key, [])
+            _pools.move_to_end(key)
+            current = (_pool_epoch, _pool_generations.get(key, 0))
+            if current != generation or len(idle) >= _POOL_SIZE:
+                to_close.append(conn)
+            else:
+                idle.append(conn)
+                _pooled_count += 1
+            while _pooled_count > _MAX_POOLED_CONNECTIONS:
+                oldest_key, oldest = next(iter(_pools.items()))
+                if oldest:
+                    to_close.append(oldest.pop(0))
+                    _pooled_count -= 1
+                if not oldest:
+                    del _pools[oldest_key]
+            if key in _pools and not _pools[key]:
+                del _pools[key]
+        # Закрываем вне блокировки: другим потокам не нужно ждать
+        for old_conn in to_close:
+            old_conn.close()
+
+
+def _pool_generation(key: str) -> Tuple[int, int]:
+    """Текущее поколение пула для пути (меняется в close_pool/close_all_pools)."""
+    with _pools_lock:
+        return (_pool_epoch, _pool_generations.get(key, 0))
+
+
+def close_pool(db_path: Path) -> None:
+    """
+    Закрывает соединения пула для указанной БД и сбрасывает её кэш схемы.
+
+    Нужен, если файл БД удалён или пересоздан: иначе запросы продолжили бы
+    идти через старые соединения. Соединения, выданные на момент вызова,
+    закрываются при возврате. Потокобезопасно: можно вызывать из потоков,
+    которые строят БД, пока другие потоки читают схему.
+    """
+    global _pooled_count
+    key = Path(db_path).as_posix()
+    with _pools_lock:
+        _pool_generations[key] = _pool_generations.get(key, 0) + 1
+        idle = _pools.pop(key, [])
+        _pooled_count -= len(idle)
+    for conn in idle:
+        conn.close()
+    invalidate_schema_cache(db_path)
+
+
+def close_all_pools() -> None:
+    """Закрывает все соединения пула (например, после оценки бенчмарка)."""
+    global _pooled_count, _pool_epoch
+    with _pools_lock:
+        _pool_epoch += 1
+        idle = [conn for conns in _pools.values() for conn in conns]
+        _pools.clear()
+        _pooled_count = 0
+    for conn in idle:
+        conn.close()
 
 
 def list_tables_and_schema(db_path: Optional[Path] = None, schema_description: Optional[str] = None, table_name: Optional[str] = None) -> str:
@@ -31,6 +227,9 @@ def list_tables_and_schema(db_path: Optional[Path] = None, schema_description: O
     Возвращает схему БД на основе реальной SQL таблицы.
     schema_description используется только для LLM, но не для отображения схемы БД.
     
+    Результат кэшируется по (db_path, PRAGMA schema_version, table_name):
+    любое DDL-изменение увеличивает schema_version и сбрасывает кэш.
+    
     Args:
         db_path: Путь к БД (если None, вернет сообщение об отсутствии данных)
         schema_description: Текстовое описание схемы (используется только для LLM, игнорируется здесь)
@@ -39,90 +238,96 @@ def list_tables_and_schema(db_path: Optional[Path] = None, schema_description: O
     if db_path is None:
         return "Нет загруженных данных. Загрузите CSV файл и описание таблицы."
     
-    conn = get_connection(readonly=True, db_path=db_path)
-    try:
+    path = Path(db_path).as_posix()
+    # Поколение пула до получения соединения: если close_pool сработал,
+    # пока строилась схема, она могла прочитаться из старого файла
+    generation = _pool_generation(path)
+    with get_pooled_connection(db_path) as conn:
         cur = conn.cursor()
-        
+        version = cur.execute("PRAGMA schema_version;").fetchone()[0]
+        key = (path, version, table_name)
+        with _schema_cache_lock:
+            schema = _schema_cache.get(key)
+        if schema is None:
+            # Схема строится вне блокировки: запрос к БД может быть долгим
+            schema = _build_schema(cur, table_name)
+            with _schema_cache_lock:
+                # close_pool сначала меняет поколение, затем сбрасывает кэш
+                # под этой же блокировкой: устаревшая схема в кэше не останется
+                if _pool_generation(path) == generation:
+                    _schema_cache[key] = schema
+        return schema
+
+
+def invalidate_schema_cache(db_path: Optional[Path] = None) -> None:
+    """
+    Сбрасывает кэш схем list_tables_and_schema.
+
+    Нужен, если файл БД был заменён целиком: у нового файла schema_version
+    может совпасть со старым. Без db_path очищается весь кэш.
+    """
+    path = Path(db_path).as_posix() if db_path is not None else None
+    with _schema_cache_lock:
+        if path is None:
+            _schema_cache.clear()
+            return
+        for key in [key for key in _schema_cache if key[0] == path]:
+            del _schema_cache[key]
+
+
+def _build_schema(cur: sqlite3.Cursor, table_name: Optional[str] = None) -> str:
+    """
+    Формирует текстовое описание схемы одним запросом:
+    sqlite_master, соединенный с табличной функцией pragma_table_info.
+    """
+    # Выводим только название столбца и тип (без NOT NULL, PRIMARY KEY и т.д.)
+    if table_name:
         # Если указано имя таблицы, показываем только её
-        if table_name:
-            # Проверяем, существует ли таблица
-            safe_table_name = table_name.replace('"', '""')  # Escape double quotes
-            tables = cur.execute(
-                f'SELECT name FROM sqlite_master WHERE type="table" AND name="{safe_table_name}";'
-            ).fetchall()
-            if not tables:
-                return f"Таблица '{table_name}' не найдена в базе данных."
-            
-            lines: List[str] = []
-            lines.append(f"TABLE {table_name}")
-            cols = cur.execute(f'PRAGMA table_info("{safe_table_name}");').fetchall()
-            for col in cols:
-                # pragma: cid, name, type, notnull, dflt_value, pk
-                # Выводим только название столбца и тип (без NOT NULL, PRIMARY KEY и т.д.)
-                cname = col[1]
-                ctype = col[2]
-                lines.append(f"  - {cname} {ctype}")
-            return "\n".join(lines)
-        else:
-            # Если имя таблицы не указано, показываем все таблицы
-            tables = cur.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;"
-            ).fetchall()
-            lines: List[str] = []
-            for (tbl_name,) in tables:
-                lines.append(f"TABLE {tbl_name}")
-                # Use parameterized query to prevent SQL injection (though table_name comes from sqlite_master)
-                # SQLite doesn't support parameters in PRAGMA, so we sanitize by quoting
-                safe_tbl_name = tbl_name.replace('"', '""')  # Escape double quotes
-                cols = cur.execute(f'PRAGMA table_info("{safe_tbl_name}");').fetchall()
-                for col in cols:
-                    # pragma: cid, name, type, notnull, dflt_value, pk
-                    # Выводим только название столбца и тип (без NOT NULL, PRIMARY KEY и т.д.)
-                    cname = col[1]
-                    ctype = col[2]
-                    lines.append(f"  - {cname} {ctype}")
-            return "\n".join(lines) if lines else "Нет таблиц в базе данных"
-    finally:
-        conn.close()
+        rows = cur.execute(_SCHEMA_SQL + " AND m.name = ? ORDER BY p.cid;", (table_name,)).fetchall()
+        if not rows:
+            return f"Таблица '{table_name}' не найдена в базе данных."
+    else:
+        # Если имя таблицы не указано, показываем все таблицы
+        rows = cur.execute(
+            _SCHEMA_SQL + " AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, p.cid;"
+        ).fetchall()
+    
+    if not rows:
+        return "Нет таблиц в базе данных"
+    return "\n".join(_format_schema_lines(rows))
+
+
+def _format_schema_lines(rows: List[Tuple[str, str, str]]) -> Iterator[str]:
+    """Строки описания схемы из (table, column, type), сгруппированных по таблице."""
+    for tbl_name, cols in itertools.groupby(rows, key=lambda row: row[0]):
+        yield f"TABLE {tbl_name}"
+        for _, cname, ctype in cols:
+            yield f"  - {cname} {ctype}"
 
 
 def execute_readonly(sql: str, db_path: Optional[Path] = None) -> Tuple[List[str], List[Tuple[Any, ...]]]:
-    if not sql.strip().lower().startswith("select"):
+    if not _SELECT_PREFIX.match(sql):
         raise ValueError("Only SELECT queries are allowed.")
-    # Check for multiple statements by counting semicolons outside of string literals
+    # Check for multiple statements: drop string literals and quoted identifiers,
+    # then any remaining semicolon separates statements
     sql_clean = sql.strip().rstrip(";")
-    # Simple check: count semicolons that are not inside quotes
-    # This is a basic check - for production, use a proper SQL parser
-    in_single_quote = False
-    in_double_quote = False
-    semicolon_count = 0
-    for i, char in enumerate(sql_clean):
-        if char == "'" and (i == 0 or sql_clean[i-1] != "\\"):
-            in_single_quote = not in_single_quote
-        elif char == '"' and (i == 0 or sql_clean[i-1] != "\\"):
-            in_double_quote = not in_double_quote
-        elif char == ";" and not in_single_quote and not in_double_quote:
-            semicolon_count += 1
-    if semicolon_count > 0:
+    if ";" in _SQL_QUOTED.sub("", sql_clean):
         raise ValueError("Only a single SELECT statement is allowed.")
 
-    conn = get_connection(readonly=True, db_path=db_path)
-    try:
+    with get_pooled_connection(db_path) as conn:
         cur = conn.cursor()
         cur.execute(sql)
         rows = cur.fetchall()
         headers = [desc[0] for desc in cur.description] if cur.description else []
         return headers, rows
-    finally:
-        conn.close()
 
 
 def sanitize_table_name(name: str) -> str:
     """Преобразует имя таблицы в валидное SQLite имя."""
     # Удаляем все недопустимые символы, оставляем только буквы, цифры и подчеркивания
-    sanitized = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+    sanitized = _NON_IDENT_CHARS.sub('_', name)
     # Убираем множественные подчеркивания
-    sanitized = re.sub(r'_+', '_', sanitized)
+    sanitized = _MULTI_UNDERSCORES.sub('_', sanitized)
     # Убираем подчеркивания в начале и конце
     sanitized = sanitized.strip('_')
     # Если имя пустое или начинается с цифры, добавляем префикс
@@ -131,8 +336,85 @@ def sanitize_table_name(name: str) -> str:
     return sanitized.lower() if sanitized else 'table'
 
 
+def _rewind(source: Union[str, Path, BinaryIO]) -> None:
+    """Возвращает файловый объект в начало перед повторным чтением."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def _sniff_encodings(source: Union[str, Path, BinaryIO], encodings: List[str]) -> List[str]:
+    """
+    Отбрасывает кодировки, которыми не декодируется начало файла.
+
+    Возвращает список, начинающийся с первой подходящей кодировки;
+    остальные остаются запасными на случай ошибки дальше по файлу.
+    """
+    if hasattr(source, "read"):
+        head = source.read(_ENCODING_SNIFF_BYTES)
+        _rewind(source)
+    else:
+        with open(source, "rb") as f:
+            head = f.read(_ENCODING_SNIFF_BYTES)
+    for i, enc in enumerate(encodings):
+        try:
+            # final=False: многобайтовый символ может быть обрезан на границе блока
+            codecs.getincrementaldecoder(enc)().decode(head, final=False)
+        except UnicodeDecodeError:
+            continue
+        return encodings[i:]
+    return encodings
+
+
+def _load_csv_chunks(
+    conn: sqlite3.Connection,
+    source: Union[str, Path, BinaryIO],
+    table_name: str,
+    encoding: str,
+) -> None:
+    """
+    Потоково загружает CSV в таблицу: в памяти держится только текущий блок строк.
+
+    Имена и типы колонок определяются по первому блоку. Пересоздание таблицы
+    и вставка всех строк — одна транзакция: при ошибке в любом блоке
+    прежняя таблица остаётся нетронутой.
+    """
+    # Контекстный менеджер закрывает файл и при ошибке (в том числе когда
+    # import_csv_to_sqlite повторяет чтение в другой кодировке)
+    with pd.read_csv(source, encoding=encoding, chunksize=_CSV_CHUNK_ROWS) as reader:
+        first = next(reader, None)
+        if first is None or first.empty:
+            raise ValueError("CSV файл пуст")
+        
+        # Санитизируем имена колонок и определяем SQL-типы по dtype (без сканирования данных).
+        # После санитизации имена содержат только [a-z0-9_], их можно подставлять в DDL
+        safe_cols = [sanitize_table_name(col) for col in first.columns]
+        columns_def = ", ".join(
+            f'"{col}" {_DTYPE_KIND_TO_SQL.get(dt.kind, "TEXT")}'
+            for col, dt in zip(safe_cols, first.dtypes)
+        )
+        
+        # executemany по строкам, собранным из списков колонок (tolist работает на C,
+        # в отличие от поэлементного itertuples); NaN SQLite сохраняет как NULL
+        placeholders = ", ".join(["?"] * len(safe_cols))
+        insert_sql = f'INSERT INTO "{table_name}" VALUES ({placeholders})'
+        
+        # Явный BEGIN: иначе sqlite3 выполнил бы DROP/CREATE вне транзакции,
+        # и ошибка в следующем блоке оставила бы пустую таблицу
+        conn.execute("BEGIN")
+        try:
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            conn.execute(f'CREATE TABLE "{table_name}" ({columns_def})')
+            for chunk in itertools.chain([first], reader):
+                conn.executemany(insert_sql, zip(*(values.tolist() for _, values in chunk.items())))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+
 def import_csv_to_sqlite(
-    csv_file_path: str,
+    csv_file_path: Union[str, Path, BinaryIO],
     table_name: str,
     db_path: Optional[Path] = None,
     encoding: str = 'utf-8'
@@ -141,7 +423,8 @@ def import_csv_to_sqlite(
     Импортирует CSV файл в SQLite базу данных.
     
     Args:
-        csv_file_path: Путь к CSV файлу
+        csv_file_path: Путь к CSV файлу или бинарный файловый объект
+            (например, BytesIO с содержимым загруженного файла)
         table_name: Имя таблицы (будет санитизировано)
         db_path: Путь к БД (если None, используется DB_PATH)
         encoding: Кодировка CSV файла
@@ -150,62 +433,33 @@ def import_csv_to_sqlite(
         Tuple[actual_table_name, db_path]
     """
     target_db = db_path or DB_PATH
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    ensure_database_exists()
     
     # Санитизируем имя таблицы
     safe_table_name = sanitize_table_name(table_name)
     
-    # Читаем CSV
+    # Кодировку подбираем по началу файла, чтобы не парсить его повторно
+    encodings = _sniff_encodings(csv_file_path, [encoding] + _CSV_FALLBACK_ENCODINGS)
+    
+    # Подключаемся к БД (не readonly для записи)
+    conn = sqlite3.connect(target_db.as_posix(), timeout=10)
     try:
-        df = pd.read_csv(csv_file_path, encoding=encoding)
-    except UnicodeDecodeError:
-        # Пробуем другие кодировки
-        for enc in ['cp1251', 'latin-1', 'iso-8859-1']:
+        _apply_pragmas(conn, readonly=False)
+        for enc in encodings:
             try:
-                df = pd.read_csv(csv_file_path, encoding=enc)
+                _rewind(csv_file_path)
+                _load_csv_chunks(conn, csv_file_path, safe_table_name, enc)
                 break
             except UnicodeDecodeError:
+                # Ошибка дальше проверенного начала файла: пробуем следующую
+                # кодировку, таблица будет пересоздана с нуля
                 continue
         else:
-            raise ValueError(f"Не удалось прочитать CSV файл с кодировками: {encoding}, cp1251, latin-1, iso-8859-1")
-    
-    if df.empty:
-        raise ValueError("CSV файл пуст")
-    
-    # Подключаемся к БД (не readonly для записи)
-    conn = sqlite3.connect(target_db.as_posix(), timeout=10)
-    try:
-        cur = conn.cursor()
-        
-        # Определяем типы данных для колонок
-        dtype_map = {}
-        for col in df.columns:
-            col_data = df[col].dropna()
-            if col_data.empty:
-                dtype_map[col] = 'TEXT'
-            elif pd.api.types.is_integer_dtype(col_data):
-                dtype_map[col] = 'INTEGER'
-            elif pd.api.types.is_float_dtype(col_data):
-                dtype_map[col] = 'REAL'
-            elif pd.api.types.is_datetime64_any_dtype(col_data):
-                dtype_map[col] = 'TEXT'
-            else:
-                dtype_map[col] = 'TEXT'
-        
-        # Создаем таблицу
-        columns_def = []
-        for col in df.columns:
-            safe_col_name = sanitize_table_name(col)
-            col_type = dtype_map[col]
-            columns_def.append(f'"{safe_col_name}" {col_type}')
-        
-        # Вставляем данные
-        df.columns = [sanitize_table_name(col) for col in df.columns]
-        df.to_sql(safe_table_name, conn, if_exists='replace', index=False)
-        
-        conn.commit()
+            raise ValueError(f"Не удалось прочитать CSV файл с кодировками: {', '.join(encodings)}")
     finally:
         conn.close()
+        # Таблица пересоздана: соединения пула и кэш схемы этой БД устарели
+        close_pool(target_db)
     
     return safe_table_name, target_db
 
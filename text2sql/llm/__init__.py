@@ -2,17 +2,27 @@ from typing import Optional, List, Dict, Any
 import json
 import re
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+from .base import BaseLLMProvider
 from .provider import get_provider, get_model_name
 from .prompts import (
     SYSTEM_PROMPT,
     VIZ_SYSTEM_PROMPT,
     EXPLAIN_SQL_SYSTEM,
     EXPLAIN_RESULT_SYSTEM,
+    ANALYZE_RESULT_SYSTEM,
 )
 from ..db import list_tables_and_schema
 
+# orjson быстрее stdlib json и сразу пишет не-ASCII как есть; без него — json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # =================================================
 # Helpers
@@ -23,6 +33,31 @@ _FORBIDDEN_SQL = re.compile(
     re.IGNORECASE,
 )
 
+_SELECT_RE = re.compile(r"select\b", re.IGNORECASE)
+
+# Нужен только первый запрос (_extract_sql всё равно обрезает по ";"),
+# поэтому генерацию SQL останавливаем на первой точке с запятой
+_SQL_STOP = [";"]
+
+
+# Ответ, целиком обёрнутый в один markdown-блок (с необязательным тегом языка)
+_SQL_FENCE = re.compile(
+    r"\A\s*```[a-z]*[ \t]*\n((?:(?!```).)*?)\s*```\s*\Z",
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+def _json_dumps(data: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _json_loads(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
 
 def _debug_set(key: str, value: str) -> None:
     if os.getenv("TEXT2SQL_DEBUG") == "1":
@@ -33,29 +68,114 @@ def _validate_sql(sql: str) -> None:
     """
     Базовая защита от опасных запросов.
     """
-    if not sql.lower().startswith("select"):
+    # Сравниваем только первые 6 символов, без копии всей строки в lower
+    if sql[:6].lower() != "select":
         raise ValueError("Only SELECT queries are allowed")
 
     if _FORBIDDEN_SQL.search(sql):
         raise ValueError("Dangerous SQL statement detected")
 
 
+def _find_json_fragment(text: str, open_char: str, close_char: str) -> Optional[str]:
+    """
+    Находит первый сбалансированный JSON-объект/массив в тексте за один проход:
+    считает глубину скобок, пропуская строковые литералы. В отличие от
+    жадного regex, не откатывается назад на длинных ответах.
+    """
+    start = text.find(open_char)
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == open_char:
+            depth += 1
+        elif char == close_char:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+
+    return None
+
+
 def _safe_json_loads(text: str) -> Dict[str, Any]:
     """
     Парсит JSON, даже если модель добавила текст вокруг.
     """
     try:
-        return json.loads(text)
+        return _json_loads(text)
     except Exception:
         pass
 
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        return json.loads(match.group(0))
+    fragment = _find_json_fragment(text, "{", "}")
+    if fragment is not None:
+        return _json_loads(fragment)
 
     raise ValueError("Invalid JSON returned by model")
 
 
+def _parse_json_array(text: str) -> List[Any]:
+    """
+    Парсит JSON-массив, даже если модель добавила текст вокруг.
+    """
+    try:
+        data = _json_loads(text)
+    except Exception:
+        fragment = _find_json_fragment(text, "[", "]")
+        if fragment is None:
+            raise ValueError("Invalid JSON returned by model")
+        data = _json_loads(fragment)
+
+    if not isinstance(data, list):
+        raise ValueError("JSON array expected")
+
+    return data
+
+
+def _parse_visualization(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Приводит ответ модели о визуализации к фиксированному набору полей.
+    """
+    return {
+        "need_chart": bool(data.get("need_chart", False)),
+        "chart_type": data.get("chart_type", "none"),
+        "x_col": data.get("x_col"),
+        "y_col": data.get("y_col"),
+    }
+
+
+def _longest_fence_part(text: str) -> str:
+    """
+    Самый длинный фрагмент между разделителями ``` (как max(text.split("```"), key=len)),
+    найденный по смещениям str.find без создания всех подстрок.
+    """
+    best_start, best_end = 0, 0
+    start = 0
+    while True:
+        end = text.find("```", start)
+        if end == -1:
+            end = len(text)
+        # При равной длине побеждает первый фрагмент, как у max()
+        if end - start > best_end - best_start:
+            best_start, best_end = start, end
+        if end == len(text):
+            break
+        start = end + 3
+    return text[best_start:best_end]
+
+
 def _extract_sql(text: str) -> str:
     """
     Жёстко извлекает SELECT-запрос из ответа LLM
@@ -67,19 +187,21 @@ def _extract_sql(text: str) -> str:
     original_text = text
     text = text.strip()
 
-    # 1. Если есть ``` — берём самый длинный блок
-    if "```" in text:
-        parts = text.split("```")
-        text = max(parts, key=len).strip()
-
-    lower = text.lower()
+    # 1. Ответ целиком — один блок ```sql ... ```: берём его содержимое
+    fence = _SQL_FENCE.match(text)
+    if fence:
+        text = fence.group(1).strip()
+    # Иначе, если есть ``` — берём самый длинный блок
+    elif "```" in text:
+        text = _longest_fence_part(text).strip()
 
     # 2. Ищем первый SELECT
-    if "select" not in lower:
+    select = _SELECT_RE.search(text)
+    if not select:
         _debug_set("TEXT2SQL_LAST_LLM_OUTPUT", original_text)
         raise ValueError("No SELECT statement found in LLM output")
 
-    text = text[lower.index("select"):]
+    text = text[select.start():]
 
     # 3. Обрезаем всё после первого ;
     if ";" in text:
@@ -87,13 +209,25 @@ def _extract_sql(text: str) -> str:
 
     sql = text.strip()
 
-    if not sql.lower().startswith("select"):
+    if sql[:6].lower() != "select":
         _debug_set("TEXT2SQL_LAST_LLM_OUTPUT", original_text)
         raise ValueError("Only SELECT queries are allowed")
 
     return sql
 
 
+def _sql_user_prompt(schema: str, question: str) -> str:
+    return (
+        "Database schema (SQLite):\n"
+        f"{schema}\n\n"
+        f"Question: {question}\n"
+        "Rules:\n"
+        "- Return ONLY one SQLite SELECT statement\n"
+        "- Do NOT explain anything\n"
+        "- Do NOT use markdown\n"
+    )
+
+
 # =================================================
 # Public API
 # =================================================
@@ -115,33 +249,171 @@ def generate_sql_from_nl(
     provider = get_provider()
     model_name = get_model_name(model)
 
+    try:
+        sql = _generate_sql_cached(provider, model_name, question, schema)
+        # Проверка дешёвая, поэтому повторяем её и для ответа из кэша
+        _validate_sql(sql)
+
+        return sql
+
+    except Exception as e:
+        _debug_set("TEXT2SQL_LAST_ERROR", str(e))
+        raise
+
+
+@lru_cache(maxsize=1024)
+def _generate_sql_cached(
+    provider: BaseLLMProvider,
+    model_name: Optional[str],
+    question: str,
+    schema: str,
+) -> str:
+    """
+    Запрос к LLM за SQL, закэшированный по (провайдер, модель, вопрос, схема).
+
+    При temperature=0 повторный вопрос к той же схеме даёт тот же ответ,
+    поэтому его можно вернуть без обращения к модели. Исключения
+    не кэшируются: неудачный запрос при следующем вызове повторится.
+    """
+    text = provider.chat(
+        system=SYSTEM_PROMPT,
+        user=_sql_user_prompt(schema, question),
+        model=model_name,
+        stop=_SQL_STOP,
+    )
+
+    _debug_set("TEXT2SQL_LAST_LLM_OUTPUT", text)
+
+    sql = _extract_sql(text)
+    _validate_sql(sql)
+
+    return sql
+
+
+def clear_sql_cache() -> None:
+    """
+    Сбрасывает кэш сгенерированных SQL (например, после смены промпта
+    или для повторной оценки модели без кэша).
+    """
+    _generate_sql_cached.cache_clear()
+
+
+def generate_sql_batch(
+    questions: List[str],
+    db_path: Optional[Path] = None,
+    schema_description: Optional[str] = None,
+    model: Optional[str] = None,
+    max_workers: int = 8,
+) -> List[str]:
+    """
+    Генерирует SELECT-запросы для нескольких вопросов к одной схеме.
+
+    Схема читается один раз, запросы к LLM уходят через
+    provider.chat_batch (не более max_workers одновременно).
+    Возвращает SQL в том же порядке, что и questions.
+    """
+    schema = list_tables_and_schema(
+        db_path=db_path,
+        schema_description=schema_description,
+    )
+
+    provider = get_provider()
+    model_name = get_model_name(model)
+
+    try:
+        texts = provider.chat_batch(
+            [(SYSTEM_PROMPT, _sql_user_prompt(schema, question)) for question in questions],
+            model=model_name,
+            max_workers=max_workers,
+            stop=_SQL_STOP,
+        )
+
+        sqls = []
+        for text in texts:
+            sql = _extract_sql(text)
+            _validate_sql(sql)
+            sqls.append(sql)
+
+        return sqls
+
+    except Exception as e:
+        _debug_set("TEXT2SQL_LAST_ERROR", str(e))
+        raise
+
+
+def generate_sql_multi(
+    questions: List[str],
+    db_path: Optional[Path] = None,
+    schema_description: Optional[str] = None,
+    model: Optional[str] = None,
+    fallback: bool = True,
+) -> List[Optional[str]]:
+    """
+    Генерирует SELECT-запросы для нескольких вопросов одним запросом к LLM.
+
+    Схема и системный промпт отправляются один раз на все вопросы;
+    модель возвращает JSON-массив SQL в том же порядке. Если ответ
+    не разобрался или отдельный запрос не прошёл проверку, такие
+    вопросы генерируются по одному через generate_sql_from_nl.
+
+    С fallback=False отдельные запросы не делаются: на месте таких
+    вопросов возвращается None, и вызывающий код сам решает, как
+    их генерировать и обрабатывать ошибки по каждому вопросу.
+    """
+    if len(questions) <= 1 and fallback:
+        return [
+            generate_sql_from_nl(question, db_path, schema_description, model)
+            for question in questions
+        ]
+
+    schema = list_tables_and_schema(
+        db_path=db_path,
+        schema_description=schema_description,
+    )
+
+    provider = get_provider()
+    model_name = get_model_name(model)
+
+    numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
     user_prompt = (
         "Database schema (SQLite):\n"
         f"{schema}\n\n"
-        f"Question: {question}\n"
+        "Questions (return JSON array of SQL strings in same order):\n"
+        f"{numbered}\n"
         "Rules:\n"
-        "- Return ONLY one SQLite SELECT statement\n"
+        "- Return ONLY a JSON array with one SQLite SELECT statement per question\n"
         "- Do NOT explain anything\n"
-        "- Do NOT use markdown\n"
     )
 
+    answers: List[Any] = []
     try:
         text = provider.chat(
             system=SYSTEM_PROMPT,
             user=user_prompt,
             model=model_name,
         )
-
         _debug_set("TEXT2SQL_LAST_LLM_OUTPUT", text)
+        answers = _parse_json_array(text)
+    except Exception as e:
+        _debug_set("TEXT2SQL_LAST_ERROR", str(e))
 
-        sql = _extract_sql(text)
-        _validate_sql(sql)
+    if len(answers) != len(questions):
+        answers = [None] * len(questions)
 
-        return sql
+    sqls = []
+    for question, answer in zip(questions, answers):
+        sql = None
+        if isinstance(answer, str):
+            try:
+                sql = _extract_sql(answer)
+                _validate_sql(sql)
+            except ValueError:
+                sql = None
+        if sql is None and fallback:
+            sql = generate_sql_from_nl(question, db_path, schema_description, model)
+        sqls.append(sql)
 
-    except Exception as e:
-        _debug_set("TEXT2SQL_LAST_ERROR", str(e))
-        raise
+    return sqls
 
 
 def decide_visualization(
@@ -169,12 +441,7 @@ def decide_visualization(
         )
         data = _safe_json_loads(text)
 
-        return {
-            "need_chart": bool(data.get("need_chart", False)),
-            "chart_type": data.get("chart_type", "none"),
-            "x_col": data.get("x_col"),
-            "y_col": data.get("y_col"),
-        }
+        return _parse_visualization(data)
 
     except Exception:
         return {
@@ -237,8 +504,77 @@ def summarize_result_brief(
     try:
         return provider.chat(
             system=EXPLAIN_RESULT_SYSTEM,
-            user=json.dumps(payload, ensure_ascii=False),
+            user=_json_dumps(payload),
             model=model_name,
         ).strip()
     except Exception:
         return ""
+
+
+def analyze_result(
+    question: str,
+    sql: str,
+    preview_rows: List[Dict[str, Any]],
+    available_columns: List[str],
+    schema_description: Optional[str] = None,
+    model: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Одним запросом к LLM получает пояснение SQL, краткий вывод
+    и решение о визуализации.
+
+    Если модель вернула невалидный JSON, результат собирается
+    отдельными вызовами explain_sql_brief, summarize_result_brief
+    и decide_visualization, выполняемыми параллельно.
+
+    Returns:
+        {"explanation": str, "summary": str, "chart": dict}
+    """
+    provider = get_provider()
+    model_name = get_model_name(model)
+
+    payload: Dict[str, Any] = {
+        "question": question,
+        "sql": sql,
+        "columns": available_columns,
+        "preview": preview_rows[:20],
+    }
+
+    if schema_description:
+        payload["schema_description"] = schema_description
+
+    try:
+        text = provider.chat(
+            system=ANALYZE_RESULT_SYSTEM,
+            user=_json_dumps(payload),
+            model=model_name,
+        )
+        data = _safe_json_loads(text)
+
+        return {
+            "explanation": str(data.get("explanation") or "").strip(),
+            "summary": str(data.get("summary") or "").strip(),
+            "chart": _parse_visualization(data),
+        }
+
+    except Exception:
+        pass
+
+    # Вызовы независимы и упираются в сеть, поэтому ждём max(t_i), а не сумму
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        explanation = executor.submit(explain_sql_brief, question, sql, model=model)
+        summary = executor.submit(
+            summarize_result_brief,
+            question,
+            sql,
+            preview_rows,
+            schema_description=schema_description,
+            model=model,
+        )
+        chart = executor.submit(decide_visualization, question, available_columns, model=model)
+
+        return {
+            "explanation": explanation.result(),
+            "summary": summary.result(),
+            "chart": chart.result(),
+        }
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple
 
 
 class BaseLLMProvider(ABC):
@@ -17,6 +18,7 @@ class BaseLLMProvider(ABC):
         system: str,
         user: str,
         model: Optional[str] = None,
+        stop: Optional[List[str]] = None,
     ) -> str:
         """
         Выполняет chat completion запрос.
@@ -25,6 +27,8 @@ class BaseLLMProvider(ABC):
             system: System prompt
             user: User prompt
             model: Имя модели (если None — используется дефолтная)
+            stop: Стоп-последовательности: генерация прекращается на первой
+                  из них (сама последовательность в ответ не попадает)
 
         Returns:
             str: сырой текст ответа модели (без постобработки)
@@ -33,3 +37,39 @@ class BaseLLMProvider(ABC):
             RuntimeError: если запрос к LLM не удался
         """
         raise NotImplementedError("LLM provider must implement chat()")
+
+    def chat_batch(
+        self,
+        requests: List[Tuple[str, str]],
+        model: Optional[str] = None,
+        max_workers: int = 8,
+        stop: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Выполняет несколько независимых chat-запросов.
+
+        Реализация по умолчанию отправляет запросы параллельно
+        (не более max_workers одновременно); провайдер с собственным
+        batch API может её переопределить.
+
+        Args:
+            requests: список пар (system, user)
+            model: Имя модели (если None — используется дефолтная)
+            max_workers: максимальное число одновременных запросов
+            stop: Стоп-последовательности для каждого запроса
+
+        Returns:
+            List[str]: ответы модели в том же порядке, что и requests
+
+        Raises:
+            RuntimeError: если какой-либо из запросов не удался
+        """
+        if not requests:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(requests))) as executor:
+            futures = [
+                executor.submit(self.chat, system, user, model, stop)
+                for system, user in requests
+            ]
+            return [future.result() for future in futures]
@@ -1,6 +1,8 @@
-from typing import Optional
+from typing import Optional, List
+import random
 import time
 
+import httpx
 import ollama
 
 from .base import BaseLLMProvider
@@ -30,38 +32,49 @@ class OllamaProvider(BaseLLMProvider):
         self.timeout = timeout
         self.max_retries = max_retries
 
-        # Проверяем, что Ollama доступен сразу
-        try:
-            ollama.list()
-        except Exception as e:
-            raise RuntimeError(
-                "Ollama is not available. "
-                "Make sure Ollama is running (ollama serve)."
-            ) from e
+        # Один клиент на провайдер: HTTP-соединение переиспользуется между вызовами
+        # (модульный ollama.chat ходит через отдельный клиент без нашего таймаута).
+        # Пул держит соединения для параллельных запросов (chat_batch, оценка
+        # бенчмарков) и не закрывает их в паузах между генерациями.
+        self._client = ollama.Client(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_keepalive_connections=20,
+                max_connections=50,
+                keepalive_expiry=90,
+            ),
+        )
 
     def chat(
         self,
         system: str,
         user: str,
         model: Optional[str] = None,
+        stop: Optional[List[str]] = None,
     ) -> str:
         """
         Выполняет chat-запрос к Ollama и возвращает текст ответа модели.
+
+        stop передаётся в options Ollama: сервер сам прекращает генерацию
+        на стоп-последовательности и не тратит время на лишние токены.
         """
         last_error: Optional[Exception] = None
         model_name = model or self.model
+        # Сообщения и опции собираем один раз: повторные попытки шлют тот же запрос
+        messages = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ]
+        options = {"temperature": 0.0}
+        if stop:
+            options["stop"] = stop
 
         for attempt in range(self.max_retries + 1):
             try:
-                response = ollama.chat(
+                response = self._client.chat(
                     model=model_name,
-                    messages=[
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user},
-                    ],
-                    options={
-                        "temperature": 0.0,
-                    },
+                    messages=messages,
+                    options=options,
                 )
 
                 content = response.get("message", {}).get("content")
@@ -72,11 +85,36 @@ class OllamaProvider(BaseLLMProvider):
 
             except Exception as e:
                 last_error = e
-                if attempt < self.max_retries:
-                    time.sleep(0.5)
+                if attempt < self.max_retries and _is_retryable(e):
+                    time.sleep(_backoff_delay(attempt))
                     continue
                 break
 
+        # Отдельной проверки доступности нет: о незапущенном сервере
+        # сообщает первый же запрос
+        if isinstance(last_error, ConnectionError):
+            raise RuntimeError(
+                "Ollama is not available. "
+                "Make sure Ollama is running (ollama serve)."
+            ) from last_error
+
         raise RuntimeError(
-            f"Ollama chat failed after {self.max_retries + 1} attempts: {last_error}"
+            f"Ollama chat failed after {attempt + 1} attempts: {last_error}"
         )
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Повторяем только временные ошибки: сеть, 5xx, 429 (перегрузка).
+    Остальные 4xx (например, модель не найдена) повтор не исправит.
+    """
+    if isinstance(error, ollama.ResponseError):
+        status = error.status_code
+        return status == 429 or status >= 500 or status < 400
+    return True
+
+
+def _backoff_delay(attempt: int) -> float:
+    # Экспоненциальная пауза с джиттером: параллельные запросы
+    # не повторяются одновременно после общей перегрузки сервера
+    return min(0.5 * 2 ** attempt, 10.0) + random.uniform(0, 0.5)
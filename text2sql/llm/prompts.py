@@ -81,3 +81,42 @@ Rules:
 - Do NOT describe technical details.
 - If the result is empty or trivial, state this clearly.
 """.strip()
+
+
+# =========================================================
+# RESULT ANALYSIS (explanation + summary + chart in one call)
+# =========================================================
+
+ANALYZE_RESULT_SYSTEM = """
+You analyze an SQL query and a preview of its results for a business user.
+
+Input (JSON):
+- question: the original question
+- sql: the SQL query
+- columns: result column names
+- preview: a small preview of result rows
+- schema_description: optional database schema description
+
+Rules:
+- Respond with VALID JSON ONLY.
+- Do not add explanations or comments outside JSON.
+- Use the following fields only:
+  {
+    "explanation": string,
+    "summary": string,
+    "need_chart": true | false,
+    "chart_type": "bar" | "line" | "pie" | "none",
+    "x_col": string | null,
+    "y_col": string | null
+  }
+
+Field guidelines:
+- "explanation": what the query does, in Russian, 2–3 concise sentences,
+  business meaning only, do NOT repeat the SQL verbatim.
+- "summary": key findings from the results, in Russian, 2–3 concise sentences,
+  no technical details; if the result is empty or trivial, state this clearly.
+- Chart: use "bar" for comparisons by category (TOP, GROUP BY),
+  "line" for time series or ordered data, "pie" only for simple part-of-whole
+  cases. x_col and y_col must be taken from columns.
+- If visualization is not useful, set need_chart=false and chart_type="none".
+""".strip()
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from typing import Optional
 
 from .base import BaseLLMProvider
@@ -19,9 +20,16 @@ def get_provider() -> BaseLLMProvider:
         LLM_PROVIDER=ollama | mistral
 
     По умолчанию используется Ollama.
+
+    Провайдер создается один раз на каждое значение LLM_PROVIDER
+    и переиспользуется между вызовами.
     """
     provider_name = os.getenv("LLM_PROVIDER", "ollama").lower()
+    return _create_provider(provider_name)
+
 
+@lru_cache(maxsize=None)
+def _create_provider(provider_name: str) -> BaseLLMProvider:
     if provider_name == "mistral":
         if MistralProvider is None:
             raise RuntimeError(
@@ -39,6 +47,14 @@ def get_provider() -> BaseLLMProvider:
     )
 
 
+def reset_provider() -> None:
+    """
+    Сбрасывает закэшированные провайдеры (например, в тестах
+    или после смены настроек подключения).
+    """
+    _create_provider.cache_clear()
+
+
 def get_model_name(default: Optional[str] = None) -> Optional[str]:
     """
     Возвращает имя модели из переменной окружения LLM_MODEL,
@@ -61,6 +61,33 @@ def main():
         help="Максимальное количество примеров для оценки (для тестирования)",
     )
     
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Количество примеров, оцениваемых параллельно (одновременных запросов к LLM)",
+    )
+    
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Сколько вопросов к одной таблице отправлять в LLM одним запросом",
+    )
+    
+    parser.add_argument(
+        "--execution-only",
+        action="store_true",
+        help="Считать только execution match (без exact match и logical form)",
+    )
+    
+    parser.add_argument(
+        "--prebuild-workers",
+        type=int,
+        default=0,
+        help="Заранее построить БД всех таблиц в N процессах (0 — строить по мере оценки)",
+    )
+    
     parser.add_argument(
         "--output",
         type=str,
@@ -68,6 +95,13 @@ def main():
         help="Путь к файлу для сохранения результатов (JSON)",
     )
     
+    parser.add_argument(
+        "--stream-output",
+        type=str,
+        default=None,
+        help="Путь к JSONL файлу, куда результаты пишутся по мере оценки",
+    )
+    
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -94,18 +128,28 @@ def main():
         dataset=dataset,
         model=args.model,
         max_examples=args.max_examples,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        compute_exact_match=not args.execution_only,
+        compute_logical_form=not args.execution_only,
+        prebuild_workers=args.prebuild_workers,
     )
     
     # Выполняем оценку
     print(f"\nОценка на сплите '{args.split}'...")
     print(f"Модель: {args.model or os.getenv('LLM_MODEL', 'default')}")
     print(f"Провайдер: {args.provider}")
+    print(f"Параллельность: {args.concurrency}")
     if args.max_examples:
         print(f"Ограничение: {args.max_examples} примеров")
     print()
     
     try:
-        results = evaluator.evaluate(split=args.split, verbose=True)
+        results = evaluator.evaluate(
+            split=args.split,
+            verbose=True,
+            stream_output_path=Path(args.stream_output) if args.stream_output else None,
+        )
     except KeyboardInterrupt:
         print("\n\nОценка прервана пользователем", file=sys.stderr)
         sys.exit(1)
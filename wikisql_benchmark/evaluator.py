@@ -3,15 +3,30 @@
 """
 
 import json
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional, Iterator
+from dataclasses import dataclass
 from tqdm import tqdm
 
 from .wikisql_dataset import WikiSQLDataset, WikiSQLExample
 from .sql_executor import SQLExecutor, normalize_sql
 from .sql_converter import wikisql_to_sql, sql_to_wikisql
-from text2sql.llm import generate_sql_from_nl
+from text2sql.db import close_all_pools
+from text2sql.llm import generate_sql_from_nl, generate_sql_multi
+
+# orjson сериализует результаты в несколько раз быстрее json.dump(indent=2)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Сколько соединений с БД таблиц держать открытыми одновременно
+_EXECUTOR_CACHE_SIZE = 64
 
 
 @dataclass
@@ -52,21 +67,49 @@ class WikiSQLEvaluator:
         dataset: WikiSQLDataset,
         model: Optional[str] = None,
         max_examples: Optional[int] = None,
+        concurrency: int = 1,
+        batch_size: int = 1,
+        compute_exact_match: bool = True,
+        compute_logical_form: bool = True,
+        prebuild_workers: int = 0,
     ):
         """
         Args:
             dataset: Экземпляр WikiSQLDataset
             model: Имя модели (если None, используется из окружения)
             max_examples: Максимальное количество примеров для оценки
+            concurrency: Сколько примеров оценивать одновременно
+                         (запросы к LLM упираются в сеть, а не в CPU)
+            batch_size: Сколько вопросов к одной таблице
+                        отправлять в LLM одним запросом (1 — по одному)
+            compute_exact_match: Считать exact match (нормализация SQL)
+            compute_logical_form: Считать logical form match (разбор
+                                  predicted SQL через sql_to_wikisql)
+            prebuild_workers: Если > 0, БД всех таблиц строятся заранее
+                              в стольких процессах (0 — по мере оценки)
         """
         self.dataset = dataset
         self.model = model
         self.max_examples = max_examples
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.compute_exact_match = compute_exact_match
+        self.compute_logical_form = compute_logical_form
+        self.prebuild_workers = prebuild_workers
+        # Открытые SQLExecutor по пути к БД (LRU): вопросы к одной таблице
+        # переиспользуют соединение вместо открытия нового на каждый пример
+        self._executors: "OrderedDict[Path, SQLExecutor]" = OrderedDict()
+        # Сколько потоков сейчас используют executor: вытесненный из LRU
+        # закрывается, только когда его отпустит последний пользователь
+        self._executor_users: Dict[SQLExecutor, int] = {}
+        self._executors_lock = threading.Lock()
     
     def evaluate(
         self,
         split: str = "dev",
         verbose: bool = True,
+        stream_output_path: Optional[Path] = None,
+        keep_in_memory: bool = True,
     ) -> List[EvaluationResult]:
         """
         Оценивает модель на указанном сплите.
@@ -74,38 +117,191 @@ class WikiSQLEvaluator:
         Args:
             split: "train", "dev" или "test"
             verbose: Показывать прогресс-бар
+            stream_output_path: Если задан, каждый результат сразу дописывается
+                                в этот файл строкой JSONL (в порядке завершения)
+            keep_in_memory: Если False, результаты не накапливаются в памяти
+                            и возвращается пустой список (имеет смысл вместе
+                            с stream_output_path)
             
         Returns:
-            Список результатов оценки
+            Список результатов оценки (в порядке примеров)
         """
         examples = self.dataset.load_examples(split)
         
         if self.max_examples:
             examples = examples[:self.max_examples]
         
-        results = []
+        if self.prebuild_workers > 0:
+            self.dataset.prebuild_dbs(examples, workers=self.prebuild_workers)
         
-        iterator = tqdm(examples, desc=f"Evaluating on {split}") if verbose else examples
+        # Результаты сохраняются в порядке примеров, а не завершения
+        results: List[Optional[EvaluationResult]] = [None] * len(examples) if keep_in_memory else []
+        # Счётчики для прогресс-бара ведём по ходу, а не пересчитываем суммами
+        done = em = ex = lf = 0
         
-        for example in iterator:
-            result = self._evaluate_single(example)
-            results.append(result)
-            
-            if verbose:
-                iterator.set_postfix({
-                    "EM": f"{sum(r.exact_match for r in results)}/{len(results)}",
-                    "EX": f"{sum(r.execution_match for r in results)}/{len(results)}",
-                    "LF": f"{sum(r.logical_form_match for r in results)}/{len(results)}",
-                })
+        progress = tqdm(total=len(examples), desc=f"Evaluating on {split}") if verbose else None
+        
+        stream = None
+        if stream_output_path is not None:
+            stream_output_path = Path(stream_output_path)
+            stream_output_path.parent.mkdir(parents=True, exist_ok=True)
+            stream = open(stream_output_path, "wb")
+        
+        try:
+            executor = ThreadPoolExecutor(max_workers=self.concurrency)
+            try:
+                futures = {
+                    executor.submit(self._evaluate_group, [examples[i] for i in group]): group
+                    for group in self._group_indices(examples)
+                }
+                pending = set(futures)
+                
+                while pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        # Забираем future из словаря, чтобы обработанные
+                        # результаты не держались в памяти до конца оценки
+                        group = futures.pop(future)
+                        for idx, result in zip(group, future.result()):
+                            if keep_in_memory:
+                                results[idx] = result
+                            if stream is not None:
+                                stream.write(_dumps_line(_result_to_dict(result)))
+                            done += 1
+                            em += result.exact_match
+                            ex += result.execution_match
+                            lf += result.logical_form_match
+                        
+                        if progress is not None:
+                            progress.update(len(group))
+                            progress.set_postfix({
+                                "EM": f"{em}/{done}",
+                                "EX": f"{ex}/{done}",
+                                "LF": f"{lf}/{done}",
+                            })
+            except BaseException:
+                # Ctrl+C или ошибка: группы из очереди (и их запросы к LLM)
+                # отменяем и не ждём завершения уже запущенных
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            executor.shutdown()
+        finally:
+            self.close_all()
+            if stream is not None:
+                stream.close()
+        
+        if progress is not None:
+            progress.close()
         
         return results
     
-    def _evaluate_single(self, example: WikiSQLExample) -> EvaluationResult:
+    @contextmanager
+    def _use_executor(self, db_path: Path) -> Iterator[SQLExecutor]:
+        """Выдает открытый SQLExecutor для БД, вытесняя давно неиспользуемые."""
+        to_close: List[SQLExecutor] = []
+        with self._executors_lock:
+            executor = self._executors.get(db_path)
+            if executor is not None:
+                self._executors.move_to_end(db_path)
+            else:
+                executor = SQLExecutor(db_path)
+                self._executors[db_path] = executor
+                if len(self._executors) > _EXECUTOR_CACHE_SIZE:
+                    _, evicted = self._executors.popitem(last=False)
+                    # Занятый executor закроет его последний пользователь
+                    if evicted not in self._executor_users:
+                        to_close.append(evicted)
+            self._executor_users[executor] = self._executor_users.get(executor, 0) + 1
+        for evicted in to_close:
+            evicted.close()
+        
+        try:
+            yield executor
+        finally:
+            with self._executors_lock:
+                users = self._executor_users.pop(executor) - 1
+                if users:
+                    self._executor_users[executor] = users
+                release = not users and self._executors.get(db_path) is not executor
+            if release:
+                executor.close()
+    
+    def close_all(self) -> None:
+        """Закрывает все закэшированные соединения с БД."""
+        with self._executors_lock:
+            # Занятые executor закроются, когда их отпустят
+            idle = [
+                executor for executor in self._executors.values()
+                if executor not in self._executor_users
+            ]
+            self._executors.clear()
+        for executor in idle:
+            executor.close()
+        # Пул text2sql.db держит соединения к БД таблиц (чтение схемы)
+        close_all_pools()
+    
+    def _group_indices(self, examples: List[WikiSQLExample]) -> List[List[int]]:
+        """
+        Разбивает примеры на группы вопросов к одной таблице
+        (не больше batch_size в группе). Возвращает индексы примеров.
+        """
+        groups: List[List[int]] = []
+        # Идём в порядке table_id: вопросы к одной таблице оказываются рядом,
+        # и кэш схемы/БД попадает подряд. Порядок результатов не меняется.
+        order = sorted(range(len(examples)), key=lambda i: examples[i].table_id)
+        for idx in order:
+            example = examples[idx]
+            if (
+                groups
+                and len(groups[-1]) < self.batch_size
+                and examples[groups[-1][0]].table_id == example.table_id
+            ):
+                groups[-1].append(idx)
+            else:
+                groups.append([idx])
+        return groups
+    
+    def _evaluate_group(self, examples: List[WikiSQLExample]) -> List[EvaluationResult]:
+        """
+        Оценивает группу примеров к одной таблице.
+        
+        Для группы из нескольких вопросов SQL генерируется одним запросом
+        к LLM (generate_sql_multi). Вопросы, для которых SQL не получен,
+        генерируются по одному в _evaluate_single: ошибка одного вопроса
+        не заставляет заново генерировать SQL для всей группы.
+        """
+        predicted: List[Optional[str]] = [None] * len(examples)
+        
+        if len(examples) > 1:
+            try:
+                db_path = self.dataset.create_table_db(examples[0])
+                predicted = generate_sql_multi(
+                    [example.question for example in examples],
+                    db_path=db_path,
+                    model=self.model,
+                    fallback=False,
+                )
+            except Exception:
+                # Ошибки запроса к LLM generate_sql_multi обрабатывает сам;
+                # сюда попадают только сбои до него (БД, схема, провайдер)
+                pass
+        
+        return [
+            self._evaluate_single(example, predicted_sql=sql)
+            for example, sql in zip(examples, predicted)
+        ]
+    
+    def _evaluate_single(
+        self,
+        example: WikiSQLExample,
+        predicted_sql: Optional[str] = None,
+    ) -> EvaluationResult:
         """
         Оценивает один пример.
         
         Args:
             example: Пример из датасета
+            predicted_sql: Уже сгенерированный SQL (если None, генерируется здесь)
             
         Returns:
             EvaluationResult
@@ -148,11 +344,12 @@ class WikiSQLEvaluator:
         
         # Генерируем SQL
         try:
-            predicted_sql = generate_sql_from_nl(
-                question=example.question,
-                db_path=db_path,
-                model=self.model,
-            )
+            if predicted_sql is None:
+                predicted_sql = generate_sql_from_nl(
+                    question=example.question,
+                    db_path=db_path,
+                    model=self.model,
+                )
         except Exception as e:
             return EvaluationResult(
                 question_id=example.question_id,
@@ -169,14 +366,17 @@ class WikiSQLEvaluator:
             )
         
         # Пытаемся конвертировать predicted SQL в структурированный формат
+        # (не нужно, если logical form не считается)
         predicted_sql_struct = None
-        if example.table:
+        if self.compute_logical_form and example.table:
             predicted_sql_struct = sql_to_wikisql(predicted_sql, example.table)
         
         # Проверяем exact match (нормализованные SQL строки)
-        gold_normalized = normalize_sql(gold_sql)
-        pred_normalized = normalize_sql(predicted_sql)
-        exact_match = gold_normalized == pred_normalized
+        exact_match = False
+        if self.compute_exact_match:
+            gold_normalized = normalize_sql(gold_sql)
+            pred_normalized = normalize_sql(predicted_sql)
+            exact_match = gold_normalized == pred_normalized
         
         # Проверяем logical form match (структурированное сравнение)
         logical_form_match = False
@@ -190,13 +390,22 @@ class WikiSQLEvaluator:
                 )
             )
         
-        # Проверяем execution match
-        executor = SQLExecutor(db_path)
-        execution_match = executor.compare_results(
-            gold_sql,
-            predicted_sql,
-            order_matters=False,
-        )
+        # Проверяем execution match. Выполнять не нужно только буквально
+        # совпавший SQL: normalize_sql меняет и строковые литералы (регистр,
+        # пробелы), поэтому exact match не гарантирует одинаковый результат
+        if gold_sql.strip().rstrip(";") == predicted_sql.strip().rstrip(";"):
+            execution_match = True
+        elif not predicted_sql.strip():
+            execution_match = False
+        else:
+            with self._use_executor(db_path) as executor:
+                execution_match = executor.compare_results(
+                    gold_sql,
+                    predicted_sql,
+                    order_matters=False,
+                    # Для агрегата (agg != 0) результат — одно значение
+                    scalar_expected=example.sql.get("agg", 0) != 0,
+                )
         
         return EvaluationResult(
             question_id=example.question_id,
@@ -220,16 +429,17 @@ class WikiSQLEvaluator:
         if len(conds1) != len(conds2):
             return False
         
-        # Сортируем условия для сравнения
+        # Сравниваем как мультимножества: порядок условий не важен,
+        # а сортировать кортежи со значениями разных типов нельзя
         def normalize_cond(cond):
             if len(cond) >= 3:
                 return tuple(cond[:3])
             return tuple(cond)
         
-        conds1_norm = sorted([normalize_cond(c) for c in conds1])
-        conds2_norm = sorted([normalize_cond(c) for c in conds2])
-        
-        return conds1_norm == conds2_norm
+        return (
+            Counter(normalize_cond(c) for c in conds1)
+            == Counter(normalize_cond(c) for c in conds2)
+        )
     
     def compute_metrics(self, results: List[EvaluationResult]) -> EvaluationMetrics:
         """
@@ -242,21 +452,26 @@ class WikiSQLEvaluator:
             EvaluationMetrics
         """
         total = len(results)
-        exact_match = sum(1 for r in results if r.exact_match)
-        execution_match = sum(1 for r in results if r.execution_match)
-        logical_form_match = sum(1 for r in results if r.logical_form_match)
-        errors = sum(1 for r in results if r.error is not None)
+        exact_match = execution_match = logical_form_match = errors = 0
+        # Один проход по результатам; bool складывается как 0/1
+        for r in results:
+            exact_match += r.exact_match
+            execution_match += r.execution_match
+            logical_form_match += r.logical_form_match
+            errors += r.error is not None
+        
+        inv_total = 1.0 / total if total > 0 else 0.0
         
         return EvaluationMetrics(
             total=total,
             exact_match=exact_match,
             execution_match=execution_match,
             logical_form_match=logical_form_match,
-            exact_match_rate=exact_match / total if total > 0 else 0.0,
-            execution_match_rate=execution_match / total if total > 0 else 0.0,
-            logical_form_match_rate=logical_form_match / total if total > 0 else 0.0,
+            exact_match_rate=exact_match * inv_total,
+            execution_match_rate=execution_match * inv_total,
+            logical_form_match_rate=logical_form_match * inv_total,
             errors=errors,
-            error_rate=errors / total if total > 0 else 0.0,
+            error_rate=errors * inv_total,
         )
     
     def save_results(
@@ -275,9 +490,30 @@ class WikiSQLEvaluator:
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
         data = {
-            "results": [asdict(r) for r in results],
-            "metrics": asdict(self.compute_metrics(results)),
+            "results": [_result_to_dict(r) for r in results],
+            "metrics": _result_to_dict(self.compute_metrics(results)),
         }
         
+        if orjson is not None:
+            output_path.write_bytes(
+                orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            )
+            return
+        
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def _dumps_line(data: Dict[str, Any]) -> bytes:
+    """Одна строка JSONL (с переводом строки) в байтах."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _result_to_dict(result: Any) -> Dict[str, Any]:
+    """
+    Поля dataclass-результата в виде dict. В отличие от asdict, не копирует
+    рекурсивно вложенные структуры (gold_sql_struct и т.п. уже обычные dict).
+    """
+    return dict(result.__dict__)
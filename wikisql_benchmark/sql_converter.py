@@ -2,6 +2,7 @@
 Модуль для конвертации между структурированным форматом WikiSQL и SQL строками.
 """
 
+import re
 from typing import Dict, Any, List, Tuple, Optional
 
 
@@ -10,6 +11,32 @@ OPERATORS = ["", "=", ">", "<", ">=", "<=", "!="]
 # Агрегации WikiSQL
 AGGREGATIONS = ["", "MAX", "MIN", "COUNT", "SUM", "AVG"]
 
+# Индекс агрегации по имени и операторы от длинных к коротким
+# (чтобы ">=" находился раньше, чем ">" или "=")
+_AGG_TO_IDX = {agg: i for i, agg in enumerate(AGGREGATIONS) if agg}
+_OPS_BY_LEN = sorted(
+    [(op, i) for i, op in enumerate(OPERATORS) if op],
+    key=lambda item: -len(item[0]),
+)
+
+# Шаблоны разбора SQL в sql_to_wikisql (вызывается для каждого примера)
+_SELECT_RE = re.compile(r'SELECT\s+(.+?)\s+FROM', re.IGNORECASE)
+_WHERE_RE = re.compile(r'WHERE\s+(.+?)(?:\s+ORDER|\s+LIMIT|$)', re.IGNORECASE)
+_AND_RE = re.compile(r'\s+AND\s+', re.IGNORECASE)
+_PAREN_RE = re.compile(r'\((.+?)\)')
+
+
+def _quote_identifier(name: str) -> str:
+    """Имя колонки в двойных кавычках (кавычка внутри удваивается)."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_value(value: Any) -> str:
+    """Значение условия как SQL-литерал: строки в одинарных кавычках."""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
 
 def wikisql_to_sql(
     sql_struct: Dict[str, Any],
@@ -41,8 +68,9 @@ def wikisql_to_sql(
     if sel_idx >= len(headers):
         raise ValueError(f"Column index {sel_idx} out of range (max: {len(headers)-1})")
     
-    column = headers[sel_idx]
-    safe_column = f'"{column.replace(\'"\', \'""\')}"'
+    # Имена колонок экранируем один раз на вызов, а не в каждом условии
+    safe_headers = [_quote_identifier(header) for header in headers]
+    safe_column = safe_headers[sel_idx]
     
     # Добавляем агрегацию
     agg = AGGREGATIONS[agg_idx] if agg_idx < len(AGGREGATIONS) else ""
@@ -53,27 +81,15 @@ def wikisql_to_sql(
     
     # Формируем WHERE условия
     conds = sql_struct.get("conds", [])
-    where_parts = []
-    
-    for cond in conds:
-        if len(cond) < 3:
-            continue
-        col_idx, op_idx, value = cond[0], cond[1], cond[2]
-        
-        if col_idx >= len(headers):
-            continue
-        
-        col_name = headers[col_idx]
-        safe_col = f'"{col_name.replace(\'"\', \'""\')}"'
-        op = OPERATORS[op_idx] if op_idx < len(OPERATORS) else "="
-        
-        # Экранируем значение
-        if isinstance(value, str):
-            safe_value = f"'{value.replace(\"'\", \"''\")}'"
-        else:
-            safe_value = str(value)
-        
-        where_parts.append(f"{safe_col} {op} {safe_value}")
+    where_parts = [
+        " ".join((
+            safe_headers[cond[0]],
+            OPERATORS[cond[1]] if cond[1] < len(OPERATORS) else "=",
+            _quote_value(cond[2]),
+        ))
+        for cond in conds
+        if len(cond) >= 3 and cond[0] < len(headers)
+    ]
     
     # Собираем SQL
     sql = f'SELECT {select_expr} FROM "{table_name}"'
@@ -98,13 +114,26 @@ def sql_to_wikisql(
     Returns:
         Структурированный SQL или None если не удалось распарсить
     """
-    import re
-    
     headers = table["header"]
-    sql_upper = sql.upper().strip()
+    # Регистр не меняем: ключевые слова ищутся IGNORECASE-шаблонами,
+    # а имена колонок и значения условий должны остаться как в запросе
+    sql = sql.strip().rstrip(";")
+    
+    # Колонки ищем сначала точно, затем без учёта регистра
+    exact_index = {}
+    folded_index = {}
+    for i, header in enumerate(headers):
+        exact_index.setdefault(header, i)
+        folded_index.setdefault(header.lower(), i)
+    
+    def find_column(name: str) -> Optional[int]:
+        idx = exact_index.get(name)
+        if idx is None:
+            idx = folded_index.get(name.lower())
+        return idx
     
     # Извлекаем SELECT выражение
-    select_match = re.search(r'SELECT\s+(.+?)\s+FROM', sql_upper, re.IGNORECASE)
+    select_match = _SELECT_RE.search(sql)
     if not select_match:
         return None
     
@@ -114,57 +143,62 @@ def sql_to_wikisql(
     agg_idx = 0
     col_idx = 0
     
-    for i, agg in enumerate(AGGREGATIONS):
-        if agg and select_expr.startswith(agg + "("):
-            agg_idx = i
-            # Извлекаем колонку из агрегации
-            col_match = re.search(r'\((.+?)\)', select_expr)
-            if col_match:
-                col_name = col_match.group(1).strip().strip('"').strip("'")
-                if col_name in headers:
-                    col_idx = headers.index(col_name)
-            break
+    func, paren, _ = select_expr.partition("(")
+    func = func.strip().upper()
+    if paren and func in _AGG_TO_IDX:
+        agg_idx = _AGG_TO_IDX[func]
+        # Извлекаем колонку из агрегации
+        col_match = _PAREN_RE.search(select_expr)
+        if col_match:
+            col_name = col_match.group(1).strip().strip('"').strip("'")
+            found = find_column(col_name)
+            if found is not None:
+                col_idx = found
     else:
         # Нет агрегации, ищем колонку напрямую
         col_name = select_expr.strip().strip('"').strip("'")
-        if col_name in headers:
-            col_idx = headers.index(col_name)
-        else:
+        found = find_column(col_name)
+        if found is None:
             return None
+        col_idx = found
     
     # Извлекаем WHERE условия
-    where_match = re.search(r'WHERE\s+(.+?)(?:\s+ORDER|\s+LIMIT|$)', sql_upper, re.IGNORECASE)
+    where_match = _WHERE_RE.search(sql)
     conds = []
     
     if where_match:
         where_clause = where_match.group(1).strip()
         # Простой парсинг условий (работает только для простых случаев)
         # Разбиваем по AND
-        conditions = re.split(r'\s+AND\s+', where_clause, flags=re.IGNORECASE)
+        conditions = _AND_RE.split(where_clause)
         
         for cond in conditions:
             cond = cond.strip()
-            # Ищем паттерн: column operator value
-            for op_idx, op in enumerate(OPERATORS):
-                if op and op in cond:
-                    parts = cond.split(op, 1)
-                    if len(parts) == 2:
-                        col_name = parts[0].strip().strip('"').strip("'")
-                        value = parts[1].strip().strip("'").strip('"')
-                        
-                        if col_name in headers:
-                            col_idx_cond = headers.index(col_name)
-                            # Пытаемся преобразовать значение в число если возможно
-                            try:
-                                if '.' in value:
-                                    value = float(value)
-                                else:
-                                    value = int(value)
-                            except:
-                                pass
-                            
-                            conds.append([col_idx_cond, op_idx, value])
-                            break
+            # Ищем паттерн: column operator value.
+            # Берём самый левый оператор, при равной позиции — самый длинный
+            op, op_idx, op_pos = None, 0, -1
+            for candidate, candidate_idx in _OPS_BY_LEN:
+                pos = cond.find(candidate)
+                if pos != -1 and (op_pos == -1 or pos < op_pos):
+                    op, op_idx, op_pos = candidate, candidate_idx, pos
+            if op is None:
+                continue
+            
+            col_name = cond[:op_pos].strip().strip('"').strip("'")
+            value = cond[op_pos + len(op):].strip().strip("'").strip('"')
+            
+            col_idx_cond = find_column(col_name)
+            if col_idx_cond is not None:
+                # Пытаемся преобразовать значение в число если возможно
+                try:
+                    if '.' in value:
+                        value = float(value)
+                    else:
+                        value = int(value)
+                except:
+                    pass
+                
+                conds.append([col_idx_cond, op_idx, value])
     
     return {
         "sel": col_idx,
@@ -3,6 +3,12 @@
 Переиспользует код из spider_benchmark/sql_executor.py
 """
 
-from spider_benchmark.sql_executor import SQLExecutor, normalize_sql
+from functools import lru_cache
+
+from spider_benchmark.sql_executor import SQLExecutor, normalize_sql as _normalize_sql
+
+# normalize_sql — чистая функция строки, а gold SQL повторяется между
+# примерами и повторными прогонами: результат нормализации кэшируем
+normalize_sql = lru_cache(maxsize=8192)(_normalize_sql)
 
 __all__ = ["SQLExecutor", "normalize_sql"]
@@ -3,10 +3,23 @@
 """
 
 import json
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 
+from text2sql.db import close_pool
+
+# orjson разбирает строки JSONL в несколько раз быстрее stdlib json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    _json_loads = json.loads
+
 
 @dataclass
 class WikiSQLExample:
@@ -32,6 +45,14 @@ class WikiSQLDataset:
         
         if not self.data_dir.exists():
             raise ValueError(f"Data directory does not exist: {data_dir}")
+        
+        # Уже созданные БД: (table_id, db_path) -> путь. Вопросов к одной
+        # таблице много, а строить её достаточно один раз за процесс
+        self._db_cache: Dict[Tuple[str, Optional[Path]], Path] = {}
+        # Блокировка на таблицу: разные таблицы строятся параллельно,
+        # а общая _db_lock держится только на время работы со словарями
+        self._build_locks: Dict[Tuple[str, Optional[Path]], threading.Lock] = {}
+        self._db_lock = threading.Lock()
     
     def load_examples(self, split: str = "dev") -> List[WikiSQLExample]:
         """
@@ -55,20 +76,21 @@ class WikiSQLDataset:
         # Загружаем таблицы в память для быстрого доступа
         tables_dict = {}
         if tables_file.exists():
-            with open(tables_file, "r", encoding="utf-8") as f:
+            # Читаем байты: оба парсера принимают UTF-8 без декодирования в str
+            with open(tables_file, "rb") as f:
                 for line in f:
                     if line.strip():
-                        table_data = json.loads(line)
+                        table_data = _json_loads(line)
                         tables_dict[table_data["id"]] = table_data
         
         # Загружаем примеры
         examples = []
-        with open(jsonl_file, "r", encoding="utf-8") as f:
+        with open(jsonl_file, "rb") as f:
             for line_num, line in enumerate(f, 1):
                 if not line.strip():
                     continue
                 try:
-                    item = json.loads(line)
+                    item = _json_loads(line)
                     example = WikiSQLExample(
                         question=item["question"],
                         sql=item["sql"],
@@ -109,6 +131,9 @@ class WikiSQLDataset:
         """
         Создает временную SQLite базу данных для таблицы из примера.
         
+        БД строится один раз на table_id: повторные вызовы возвращают
+        уже созданный файл. Потокобезопасно.
+        
         Args:
             example: Пример из датасета
             db_path: Путь для сохранения БД (если None, создается временный файл)
@@ -116,63 +141,81 @@ class WikiSQLDataset:
         Returns:
             Path к созданной БД
         """
-        import sqlite3
-        import tempfile
-        
         if example.table is None:
             raise ValueError(f"Table data not available for table_id={example.table_id}")
         
+        key = (example.table_id, Path(db_path) if db_path is not None else None)
+        # Уже построенная БД возвращается без блокировок
+        cached = self._db_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        with self._db_lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            # Пока ждали, таблицу мог построить другой поток
+            cached = self._db_cache.get(key)
+            if cached is None:
+                cached = self._build_table_db(example, db_path)
+                self._db_cache[key] = cached
+                with self._db_lock:
+                    self._build_locks.pop(key, None)
+        return cached
+    
+    def _build_table_db(self, example: WikiSQLExample, db_path: Optional[Path] = None) -> Path:
+        """Записывает таблицу примера в SQLite файл (с нуля) и возвращает путь."""
         if db_path is None:
-            # Создаем временный файл
-            temp_dir = self.data_dir / "temp_dbs"
-            temp_dir.mkdir(exist_ok=True)
-            db_path = temp_dir / f"{example.table_id}.db"
+            db_path = self._default_db_path(example.table_id)
+        db_path = _write_table_db(example.table, Path(db_path))
+        # Файл пересоздан: соединения пула к старому файлу устарели
+        close_pool(db_path)
+        return db_path
+    
+    def _default_db_path(self, table_id: str) -> Path:
+        """Путь к временной БД таблицы (в data_dir/temp_dbs)."""
+        temp_dir = self.data_dir / "temp_dbs"
+        temp_dir.mkdir(exist_ok=True)
+        return temp_dir / f"{table_id}.db"
+    
+    def prebuild_dbs(
+        self,
+        examples: List[WikiSQLExample],
+        workers: Optional[int] = None,
+    ) -> None:
+        """
+        Заранее строит БД всех таблиц, встречающихся в примерах,
+        параллельно в нескольких процессах.
         
-        db_path = Path(db_path)
+        Загрузка строк в SQLite упирается в CPU, поэтому процессы
+        (а не потоки) масштабируются по ядрам. Готовые пути попадают
+        в кэш create_table_db, и во время оценки БД уже не строятся.
         
-        # Создаем БД и таблицу
-        conn = sqlite3.connect(db_path.as_posix())
-        try:
-            cur = conn.cursor()
-            
-            # Получаем заголовки и типы
-            headers = example.table["header"]
-            types = example.table.get("types", ["text"] * len(headers))
-            rows = example.table.get("rows", [])
-            
-            # Создаем таблицу
-            columns = []
-            for i, (header, col_type) in enumerate(zip(headers, types)):
-                # Санитизируем имя колонки
-                safe_header = header.replace('"', '""').replace("'", "''")
-                sqlite_type = self._convert_type(col_type)
-                columns.append(f'"{safe_header}" {sqlite_type}')
-            
-            create_sql = f'CREATE TABLE IF NOT EXISTS "table" ({", ".join(columns)})'
-            cur.execute(create_sql)
-            
-            # Вставляем данные
-            if rows:
-                placeholders = ", ".join(["?"] * len(headers))
-                insert_sql = f'INSERT INTO "table" VALUES ({placeholders})'
-                cur.executemany(insert_sql, rows)
-            
-            conn.commit()
-        finally:
-            conn.close()
+        Args:
+            examples: Примеры, таблицы которых нужно построить
+            workers: Число процессов (если None — по числу ядер)
+        """
+        tables: Dict[str, Dict[str, Any]] = {}
+        with self._db_lock:
+            for example in examples:
+                if (
+                    example.table is not None
+                    and (example.table_id, None) not in self._db_cache
+                ):
+                    tables.setdefault(example.table_id, example.table)
         
-        return db_path
-    
-    def _convert_type(self, col_type: str) -> str:
-        """Конвертирует тип WikiSQL в SQLite тип."""
-        type_map = {
-            "text": "TEXT",
-            "number": "REAL",
-            "real": "REAL",
-            "integer": "INTEGER",
-            "int": "INTEGER",
-        }
-        return type_map.get(col_type.lower(), "TEXT")
+        if not tables:
+            return
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_write_table_db, table, self._default_db_path(table_id)): table_id
+                for table_id, table in tables.items()
+            }
+            for future in as_completed(futures):
+                db_path = future.result()
+                close_pool(db_path)
+                with self._db_lock:
+                    self._db_cache[(futures[future], None)] = db_path
     
     def list_table_ids(self) -> List[str]:
         """Возвращает список всех доступных table_id."""
@@ -180,17 +223,89 @@ class WikiSQLDataset:
         for jsonl_file in self.data_dir.glob("*.jsonl"):
             if ".tables.jsonl" in jsonl_file.name:
                 continue
-            with open(jsonl_file, "r", encoding="utf-8") as f:
+            with open(jsonl_file, "rb") as f:
                 for line in f:
                     if line.strip():
                         try:
-                            item = json.loads(line)
+                            item = _json_loads(line)
                             table_ids.add(item["table_id"])
                         except:
                             pass
         return sorted(table_ids)
 
 
+def _convert_type(col_type: str) -> str:
+    """Конвертирует тип WikiSQL в SQLite тип."""
+    type_map = {
+        "text": "TEXT",
+        "number": "REAL",
+        "real": "REAL",
+        "integer": "INTEGER",
+        "int": "INTEGER",
+    }
+    return type_map.get(col_type.lower(), "TEXT")
+
+
+def _write_table_db(table: Dict[str, Any], db_path: Path) -> Path:
+    """
+    Записывает таблицу WikiSQL в SQLite файл (с нуля) и возвращает путь.
+    
+    Функция уровня модуля, чтобы её можно было выполнять
+    в дочерних процессах (WikiSQLDataset.prebuild_dbs).
+    """
+    # Создаем БД и таблицу
+    # isolation_level=None: транзакцией управляем сами (BEGIN/COMMIT ниже)
+    conn = sqlite3.connect(db_path.as_posix(), isolation_level=None)
+    try:
+        # БД одноразовые и пересобираются при следующем запуске,
+        # поэтому надёжность записи не нужна: без fsync и журнала на диске
+        conn.executescript(
+            "PRAGMA journal_mode=MEMORY;"
+            "PRAGMA synchronous=OFF;"
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA cache_size=-65536;"
+        )
+        cur = conn.cursor()
+        
+        # Получаем заголовки и типы
+        headers = table["header"]
+        types = table.get("types", ["text"] * len(headers))
+        rows = table.get("rows", [])
+        
+        # Создаем таблицу
+        columns = []
+        for i, (header, col_type) in enumerate(zip(headers, types)):
+            # Санитизируем имя колонки
+            safe_header = header.replace('"', '""').replace("'", "''")
+            sqlite_type = _convert_type(col_type)
+            columns.append(f'"{safe_header}" {sqlite_type}')
+        
+        # Вся загрузка — одна транзакция
+        cur.execute("BEGIN")
+        
+        # Файл мог остаться от прошлого запуска: пересоздаём таблицу,
+        # иначе строки вставились бы повторно
+        cur.execute('DROP TABLE IF EXISTS "table"')
+        create_sql = f'CREATE TABLE "table" ({", ".join(columns)})'
+        cur.execute(create_sql)
+        
+        # Вставляем данные
+        if rows:
+            placeholders = ", ".join(["?"] * len(headers))
+            insert_sql = f'INSERT INTO "table" VALUES ({placeholders})'
+            cur.executemany(insert_sql, rows)
+        
+        cur.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    
+    return db_path
+
+
 def load_wikisql_dataset(data_dir: str) -> WikiSQLDataset:
     """
     Удобная функция для создания WikiSQLDataset.